@@ -1,17 +1,52 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Request
+from fastapi import APIRouter, UploadFile, File, HTTPException, BackgroundTasks, Request, Response, Depends
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Dict, Any
+from datetime import datetime, timezone
+from typing import Dict, Any, List, Tuple
+from urllib.parse import quote
+import asyncio
+import time
+import orjson
 import logging
 
-from services.analysis_service import analysis_service
+from services.analysis_service import AnalysisService
 from utils.file_utils import create_session_id, save_uploaded_file, cleanup_session, get_file_path
-from config.settings import VALID_SEARCH_ENGINES, get_dynamic_public_url
+from utils.result_cache import result_cache, has_stage_error
+from config.settings import VALID_SEARCH_ENGINES, MAX_BATCH_FILES
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Pre-encoded health responses are reused for HEALTH_CACHE_TTL seconds (monotonic time, body)
+HEALTH_CACHE_TTL = 1.0
+_health_cache: Tuple[float, bytes] = (float("-inf"), b"")
+
+def _utc_timestamp() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+_VALID_ENGINES_MSG = f"Invalid search engine. Valid engines: {', '.join(sorted(VALID_SEARCH_ENGINES))}"
+
+def _bing_search_url(url: str) -> str:
+    encoded_url = quote(url, safe='')
+    return f"https://www.bing.com/images/search?view=detailv2&iss=SBI&form=SBIVSP&sbisrc=UrlPaste&q=imgurl:{encoded_url}&selectedindex=0&id={encoded_url}&mediaurl={encoded_url}"
+
+# Reverse search URL formats per engine, keyed by engine name
+SEARCH_URL_BUILDERS = {
+    # Google Lens format - using the correct endpoint and parameters
+    "google": lambda url: f"https://lens.google/search?ep=ccm&s=4&im={quote(url, safe='')}",
+    # Bing format - using the actual Bing reverse image search format
+    "bing": _bing_search_url,
+    # Yandex format - using their specific parameters
+    "yandex": lambda url: f"https://yandex.com/images/search?rpt=imageview&source=collections&url={quote(url, safe='')}",
+    # TinEye format - direct URL parameter
+    "tineye": lambda url: f"https://www.tineye.com/search?url={url}",
+}
+
+def get_service(request: Request) -> AnalysisService:
+    """Dependency returning the AnalysisService loaded at application startup."""
+    return request.app.state.analysis_service
+
 class AnalysisResult(BaseModel):
     image_id: str
     filename: str
@@ -19,11 +54,19 @@ class AnalysisResult(BaseModel):
     results: Dict[str, Any]
     timestamp: str
 
-@router.post("/analyze", response_model=AnalysisResult)
+# The analysis routes return ORJSONResponse directly: results carry numpy arrays that
+# orjson serializes natively but response_model validation (jsonable_encoder) can't.
+# The schemas are still documented through `responses`.
+@router.post(
+    "/analyze",
+    response_class=ORJSONResponse,
+    responses={200: {"model": AnalysisResult}}
+)
 async def analyze_image(
     request: Request,
     file: UploadFile = File(...),
-    background_tasks: BackgroundTasks = None
+    background_tasks: BackgroundTasks = None,
+    analysis_service: AnalysisService = Depends(get_service)
 ):
     """Analyze an uploaded image for forensic information."""
     try:
@@ -31,14 +74,21 @@ async def analyze_image(
         session_id = create_session_id()
         
         # Save image
-        image_path = save_uploaded_file(file, session_id)
+        image_path, digest = await save_uploaded_file(file, session_id)
         
-        # Run analysis
-        logger.info(f"Starting analysis for session {session_id}")
-        results = analysis_service.analyze(image_path)
+        # Run analysis, reusing results for identical uploads
+        results = result_cache.lookup(digest)
+        if results is None:
+            logger.info("Starting analysis for session %s", session_id)
+            results = await analysis_service.analyze(image_path)
+            # Don't pin a transient failure to this image until it's evicted
+            if not has_stage_error(results):
+                result_cache.update(digest, results)
+        else:
+            logger.info("Using cached analysis for session %s", session_id)
         
         # Get dynamic public URL for the image
-        public_base_url = get_dynamic_public_url(dict(request.headers))
+        public_base_url = request.state.public_base_url
         image_filename = image_path.split('/')[-1]
         public_image_url = f"{public_base_url}/uploads/{session_id}/{image_filename}"
         
@@ -48,26 +98,86 @@ async def analyze_image(
             filename=file.filename,
             session_id=session_id,
             results=results,
-            timestamp=datetime.now().isoformat()
+            timestamp=_utc_timestamp()
         )
         
         # Do NOT schedule cleanup here; handled by background job
         # if background_tasks:
         #     background_tasks.add_task(cleanup_session, session_id)
         
-        return response
+        return ORJSONResponse(response.model_dump())
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Analysis failed: {str(e)}")
+        logger.error("Analysis failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@router.post(
+    "/analyze_batch",
+    response_class=ORJSONResponse,
+    responses={200: {"model": List[AnalysisResult]}}
+)
+async def analyze_image_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    analysis_service: AnalysisService = Depends(get_service)
+):
+    """Analyze several uploaded images in one request, batching model inference."""
+    if len(files) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files. Maximum per batch: {MAX_BATCH_FILES}"
+        )
+    try:
+        # All images in a batch share one session
+        session_id = create_session_id()
+        
+        # Save images concurrently
+        saved = await asyncio.gather(*(save_uploaded_file(file, session_id) for file in files))
+        
+        # Only analyze images whose results aren't cached
+        results_by_digest = {}
+        pending = {}
+        for image_path, digest in saved:
+            results = result_cache.lookup(digest)
+            if results is not None:
+                results_by_digest[digest] = results
+            else:
+                pending.setdefault(digest, image_path)
+        
+        if pending:
+            logger.info("Starting batch analysis of %s images for session %s", len(pending), session_id)
+            batch_results = await analysis_service.analyze_batch(list(pending.values()))
+            for digest, results in zip(pending, batch_results):
+                if not has_stage_error(results):
+                    result_cache.update(digest, results)
+                results_by_digest[digest] = results
+        
+        timestamp = _utc_timestamp()
+        return ORJSONResponse([
+            AnalysisResult(
+                image_id=image_path.split('/')[-1],
+                filename=file.filename,
+                session_id=session_id,
+                results=results_by_digest[digest],
+                timestamp=timestamp
+            ).model_dump()
+            for file, (image_path, digest) in zip(files, saved)
+        ])
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Batch analysis failed: %s", e)
+        raise HTTPException(status_code=500, detail=f"Batch analysis failed: {str(e)}")
+
 # Optional: Manual cleanup endpoint for admin/testing
 @router.post("/cleanup/{session_id}")
 async def manual_cleanup(session_id: str):
     try:
-        cleanup_session(session_id)
+        await asyncio.to_thread(cleanup_session, session_id)
         return {"status": "success", "message": f"Session {session_id} cleaned up."}
     except Exception as e:
-        logger.error(f"Manual cleanup failed: {str(e)}")
+        logger.error("Manual cleanup failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Manual cleanup failed: {str(e)}")
 
 @router.get("/reverse/{engine}")
@@ -81,10 +191,7 @@ async def reverse_search(
     try:
         # Validate engine
         if engine not in VALID_SEARCH_ENGINES:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid search engine. Valid engines: {', '.join(VALID_SEARCH_ENGINES)}"
-            )
+            raise HTTPException(status_code=400, detail=_VALID_ENGINES_MSG)
             
         # Get image path
         image_path = get_file_path(session_id, image_id)
@@ -92,37 +199,23 @@ async def reverse_search(
             raise HTTPException(status_code=404, detail="Image not found")
             
         # Get dynamic public URL for the image
-        public_base_url = get_dynamic_public_url(dict(request.headers))
+        public_base_url = request.state.public_base_url
         public_image_url = f"{public_base_url}/uploads/{session_id}/{image_id}"
         
         # Generate search URL based on engine with correct formats
-        search_url = ""
-        if engine == "google":
-            # Google Lens format - using the correct endpoint and parameters
-            import urllib.parse
-            encoded_url = urllib.parse.quote(public_image_url, safe='')
-            search_url = f"https://lens.google/search?ep=ccm&s=4&im={encoded_url}"
-        elif engine == "bing":
-            # Bing format - using the actual Bing reverse image search format
-            import urllib.parse
-            encoded_url = urllib.parse.quote(public_image_url, safe='')
-            search_url = f"https://www.bing.com/images/search?view=detailv2&iss=SBI&form=SBIVSP&sbisrc=UrlPaste&q=imgurl:{encoded_url}&selectedindex=0&id={encoded_url}&mediaurl={encoded_url}"
-        elif engine == "yandex":
-            # Yandex format - using their specific parameters
-            import urllib.parse
-            encoded_url = urllib.parse.quote(public_image_url, safe='')
-            search_url = f"https://yandex.com/images/search?rpt=imageview&source=collections&url={encoded_url}"
-        elif engine == "tineye":
-            # TinEye format - direct URL parameter
-            search_url = f"https://www.tineye.com/search?url={public_image_url}"
+        search_url = SEARCH_URL_BUILDERS[engine](public_image_url)
             
         return {"search_url": search_url}
         
     except Exception as e:
-        logger.error(f"Reverse search failed: {str(e)}")
+        logger.error("Reverse search failed: %s", e)
         raise HTTPException(status_code=500, detail=f"Reverse search failed: {str(e)}")
 
 @router.get("/health")
 async def health_check():
     """Health check endpoint."""
-    return {"status": "healthy", "timestamp": datetime.now().isoformat()} 
\ No newline at end of file
+    global _health_cache
+    now = time.monotonic()
+    if now - _health_cache[0] >= HEALTH_CACHE_TTL:
+        _health_cache = (now, orjson.dumps({"status": "healthy", "timestamp": _utc_timestamp()}))
+    return Response(content=_health_cache[1], media_type="application/json") 
\ No newline at end of file
@@ -1,8 +1,13 @@
 import os
 import socket
+import functools
+import logging
+import threading
 import requests
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Mapping
+
+logger = logging.getLogger(__name__)
 
 # Base directory
 BASE_DIR = Path(__file__).parent.parent
@@ -10,6 +15,9 @@ BASE_DIR = Path(__file__).parent.parent
 # Upload settings
 UPLOADS_DIR = BASE_DIR / "uploads"
 UPLOADS_DIR.mkdir(exist_ok=True)
+UPLOADS_STR = os.path.realpath(UPLOADS_DIR)  # Resolved string form for per-request path joins
+SESSION_MAX_AGE = 60 * 60  # Seconds before an upload session is deleted
+CLEANUP_MIN_INTERVAL = 60  # Minimum seconds between cleanup passes
 
 # Model paths
 MODELS_DIR = BASE_DIR / "models"
@@ -30,16 +38,44 @@ CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_METHODS = ["*"]
 CORS_ALLOW_HEADERS = ["*"]
 
+# Response compression
+GZIP_MINIMUM_SIZE = 1024  # Bytes; smaller responses are sent uncompressed
+GZIP_COMPRESS_LEVEL = 5  # zlib level; 9 costs several times the CPU for a few percent on JSON
+
 # Logging
 LOG_LEVEL = "INFO"
 LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 # Analysis settings
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"}
+ALLOWED_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".bmp", ".tiff", ".webp"})
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB per read when streaming uploads to disk
+RESULT_CACHE_SIZE = 512  # Analysis results kept in memory, keyed by upload content hash
+MAX_BATCH_FILES = 16  # Maximum images accepted by a single batch analysis request
+AI_BATCH_SIZE = 8  # Images per AI detector forward pass when analyzing a batch
+AI_BATCH_WINDOW = 0.05  # Seconds to wait for concurrent requests to join an AI detector batch
+TRUFOR_BATCH_SIZE = 4  # Maximum concurrent images per TruFor forward pass
+TRUFOR_BATCH_WINDOW = 0.005  # Seconds to wait for concurrent requests to join a TruFor batch
+TRUFOR_WARMUP_SIZES = (512, 1024, 2048)  # Square input sizes run at startup to fill the CUDA allocator cache
+CUDA_MEMORY_HISTORY = os.getenv('CUDA_MEMORY_HISTORY') == '1'  # Record allocator history for fragmentation profiling
+# Threads running analysis stages (EXIF, TruFor, AI, faces). Each request holds up to 4 of
+# them, with the TruFor and AI stages blocked in their batcher's submit(), so the pool has
+# room for TRUFOR_BATCH_SIZE requests to reach the batchers together.
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', str(4 * TRUFOR_BATCH_SIZE)))
+
+def _physical_cpu_count() -> int:
+    """Physical core count (hyperthreads share execution units, so they don't help GEMMs)."""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    return cores or os.cpu_count() or 1
+
+CPU_THREADS = int(os.getenv('CPU_THREADS', str(_physical_cpu_count())))  # Intra-op threads for CPU inference
 
 # Reverse search engines
-VALID_SEARCH_ENGINES = ["google", "bing", "yandex", "tineye"]
+VALID_SEARCH_ENGINES = frozenset({"google", "bing", "yandex", "tineye"})
 
 def get_public_base_url() -> str:
     """
@@ -98,36 +134,62 @@ def get_public_base_url() -> str:
         return 'http://localhost:8000'
         
     except Exception as e:
-        print(f"Warning: Could not determine public URL automatically: {e}")
+        logger.warning("Could not determine public URL automatically: %s", e)
         return 'http://localhost:8000'
 
 # Dynamic public URL configuration
-PUBLIC_BASE_URL = get_public_base_url()
+# Detection may block on a network lookup, so start from the environment value
+# (or localhost) and resolve the real URL in the background.
+ENV_PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL')
+PUBLIC_BASE_URL = ENV_PUBLIC_BASE_URL or 'http://localhost:8000'
+_resolved_public_base_url: Optional[str] = None
+
+def _resolve_public_base_url() -> None:
+    """Run public URL detection and publish the result for get_dynamic_public_url."""
+    global _resolved_public_base_url
+    _resolved_public_base_url = get_public_base_url()
+    logger.info("Using public base URL: %s", _resolved_public_base_url)
 
-print(f"Using public base URL: {PUBLIC_BASE_URL}")
+threading.Thread(target=_resolve_public_base_url, daemon=True).start()
 
-def get_dynamic_public_url(request_headers: dict = None) -> str:
+def get_dynamic_public_url(request_headers: Optional[Mapping[str, str]] = None) -> str:
     """
     Get the public URL dynamically, considering request headers for better detection.
     This is used in API routes to get the most accurate public URL.
     """
+    if not request_headers:
+        url = _resolve_dynamic_public_url(None, None, None, ENV_PUBLIC_BASE_URL)
+    else:
+        url = _resolve_dynamic_public_url(
+            request_headers.get('X-Forwarded-Host'),
+            request_headers.get('X-Forwarded-Proto'),
+            request_headers.get('Host'),
+            ENV_PUBLIC_BASE_URL,
+        )
+    
+    # Fall back to the static detection, or the startup default until it completes
+    return url or _resolved_public_base_url or PUBLIC_BASE_URL
+
+@functools.lru_cache(maxsize=64)
+def _resolve_dynamic_public_url(
+    x_forwarded_host: Optional[str],
+    x_forwarded_proto: Optional[str],
+    host: Optional[str],
+    env_public_base_url: Optional[str],
+) -> Optional[str]:
+    """Resolve the public URL from the relevant request headers; memoized per origin.
+    Returns None when the headers don't identify it, so the caller can fall back to
+    the background-detected URL without caching it here."""
     # If explicitly set, use it
-    if os.getenv('PUBLIC_BASE_URL'):
-        return os.getenv('PUBLIC_BASE_URL')
+    if env_public_base_url:
+        return env_public_base_url
     
-    # If we have request headers, try to extract the actual URL
-    if request_headers:
-        # Check for Cloudflare Tunnel headers
-        cf_connecting_ip = request_headers.get('CF-Connecting-IP')
-        x_forwarded_host = request_headers.get('X-Forwarded-Host')
-        host = request_headers.get('Host')
-        
-        if x_forwarded_host:
-            protocol = 'https' if request_headers.get('X-Forwarded-Proto') == 'https' else 'http'
-            return f"{protocol}://{x_forwarded_host}"
-        elif host and 'trycloudflare.com' in host:
-            protocol = 'https' if request_headers.get('X-Forwarded-Proto') == 'https' else 'http'
-            return f"{protocol}://{host}"
+    # Check for Cloudflare Tunnel / reverse proxy headers
+    if x_forwarded_host:
+        protocol = 'https' if x_forwarded_proto == 'https' else 'http'
+        return f"{protocol}://{x_forwarded_host}"
+    elif host and 'trycloudflare.com' in host:
+        protocol = 'https' if x_forwarded_proto == 'https' else 'http'
+        return f"{protocol}://{host}"
     
-    # Fall back to the static detection
-    return PUBLIC_BASE_URL 
\ No newline at end of file
+    return None
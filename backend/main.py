@@ -1,20 +1,25 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from fastapi import Request
+from fastapi.responses import ORJSONResponse
+import asyncio
 import logging
-import threading
+import os
+import shutil
 import time
-from datetime import datetime, timedelta
+from typing import Optional
 from pathlib import Path
 
 from config.settings import (
     API_TITLE, API_VERSION, API_DESCRIPTION,
     CORS_ORIGINS, CORS_ALLOW_CREDENTIALS, CORS_ALLOW_METHODS, CORS_ALLOW_HEADERS,
-    LOG_LEVEL, LOG_FORMAT, UPLOADS_DIR
+    LOG_LEVEL, LOG_FORMAT, UPLOADS_DIR,
+    SESSION_MAX_AGE, CLEANUP_MIN_INTERVAL, GZIP_MINIMUM_SIZE, GZIP_COMPRESS_LEVEL,
+    get_dynamic_public_url
 )
 from api.routes import router
+from services.analysis_service import get_analysis_service
 
 # Configure logging
 logging.basicConfig(level=getattr(logging, LOG_LEVEL), format=LOG_FORMAT)
@@ -24,7 +29,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title=API_TITLE,
     version=API_VERSION,
-    description=API_DESCRIPTION
+    description=API_DESCRIPTION,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS
@@ -36,53 +42,91 @@ app.add_middleware(
     allow_headers=CORS_ALLOW_HEADERS,
 )
 
-# Custom static file handler for uploads that handles query parameters
-@app.get("/uploads/{path:path}")
-@app.head("/uploads/{path:path}")
-async def serve_upload_file(path: str, request: Request):
-    """Serve uploaded files, ignoring query parameters."""
-    file_path = UPLOADS_DIR / path
-    if file_path.exists() and file_path.is_file():
-        return FileResponse(file_path)
-    else:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="File not found")
+UPLOADS_MOUNT_PATH = "/uploads"
+
+class APIGZipMiddleware:
+    """GZipMiddleware for the API only. Uploaded images are already compressed, and
+    Starlette's GZipMiddleware doesn't look at content type, so /uploads is passed through."""
+    
+    def __init__(self, app, minimum_size: int, compresslevel: int):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, minimum_size=minimum_size, compresslevel=compresslevel)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].startswith(UPLOADS_MOUNT_PATH + "/"):
+            await self.gzip_app(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+# Compress larger responses (analysis reports) for clients sending Accept-Encoding: gzip
+app.add_middleware(APIGZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+
+@app.middleware("http")
+async def resolve_public_base_url(request: Request, call_next):
+    """Resolve the public base URL once per request for handlers to read from request.state."""
+    # Headers lookups are case-insensitive and avoid copying every header into a dict
+    request.state.public_base_url = get_dynamic_public_url(request.headers)
+    return await call_next(request)
 
 # Include routes
 app.include_router(router, prefix="/api/v1")
 
-def cleanup_old_sessions():
-    uploads_dir = UPLOADS_DIR
-    now = datetime.now()
-    cutoff = now - timedelta(hours=1)
-    for session_dir in uploads_dir.iterdir():
-        if session_dir.is_dir():
-            mtime = datetime.fromtimestamp(session_dir.stat().st_mtime)
+# Serve uploaded files. StaticFiles routes on the path only (query parameters appended
+# by search engines are ignored) and answers conditional GETs via ETag/Last-Modified.
+app.mount(UPLOADS_MOUNT_PATH, StaticFiles(directory=UPLOADS_DIR), name="uploads")
+
+def cleanup_old_sessions() -> Optional[float]:
+    """Delete expired session directories and return the oldest remaining mtime, if any."""
+    cutoff = time.time() - SESSION_MAX_AGE
+    oldest = None
+    with os.scandir(UPLOADS_DIR) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            mtime = entry.stat(follow_symlinks=False).st_mtime
             if mtime < cutoff:
-                for file_path in session_dir.iterdir():
-                    if file_path.is_file():
-                        file_path.unlink()
-                session_dir.rmdir()
-                logger.info(f"[CLEANUP] Deleted old session: {session_dir}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+                logger.info("[CLEANUP] Deleted old session: %s", entry.path)
+            elif oldest is None or mtime < oldest:
+                oldest = mtime
+    return oldest
 
-def start_cleanup_thread():
-    def run():
-        while True:
-            cleanup_old_sessions()
-            time.sleep(600)  # 10 minutes
-    t = threading.Thread(target=run, daemon=True)
-    t.start()
+async def _cleanup_loop():
+    """Periodically delete expired sessions, sleeping until the next one is due."""
+    while True:
+        oldest = None
+        try:
+            oldest = await asyncio.to_thread(cleanup_old_sessions)
+        except Exception as e:
+            logger.error("[CLEANUP] Session cleanup failed: %s", e)
+        # Sleep until the oldest remaining session expires; with no sessions
+        # nothing can expire sooner than a full SESSION_MAX_AGE from now
+        if oldest is None:
+            delay = SESSION_MAX_AGE
+        else:
+            delay = max(CLEANUP_MIN_INTERVAL, oldest + SESSION_MAX_AGE - time.time())
+        await asyncio.sleep(delay)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup."""
     logger.info("Starting Image Forensics API...")
-    start_cleanup_thread()
+    app.state.cleanup_task = asyncio.create_task(_cleanup_loop())
+    # Load models off the event loop; routes get the service through app.state
+    app.state.analysis_service = await asyncio.to_thread(get_analysis_service)
+    await asyncio.to_thread(app.state.analysis_service.warmup)
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup on shutdown."""
     logger.info("Shutting down Image Forensics API...")
+    # Startup may have failed part-way, e.g. while loading models
+    cleanup_task = getattr(app.state, "cleanup_task", None)
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+    analysis_service = getattr(app.state, "analysis_service", None)
+    if analysis_service is not None:
+        analysis_service.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
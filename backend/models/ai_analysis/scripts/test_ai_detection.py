@@ -11,63 +11,107 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.append(str(Path(__file__).parent.parent.parent))
 
+import torch
 from transformers import pipeline
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Pipeline is loaded on first use and reused by later calls
+_PIPE = None
+
+def _get_pipe():
+    """Return the shared SDXL detector pipeline, loading it on first call."""
+    global _PIPE
+    if _PIPE is None:
+        device = 0 if torch.cuda.is_available() else -1
+        _PIPE = pipeline("image-classification", model="Organika/sdxl-detector", device=device)
+    return _PIPE
+
+def _summarize_results(results) -> dict:
+    """Turn the pipeline's label scores for one image into the AI detection result."""
+    ai_score = 0.0
+    for result in results:
+        if result['label'] == 'artificial':
+            ai_score = result['score']
+            break
+    
+    is_ai_generated = ai_score > 0.5
+    confidence = ai_score if is_ai_generated else 1 - ai_score
+    
+    return {
+        "ai_detection": {
+            "is_ai_generated": is_ai_generated,
+            "confidence_score": round(confidence, 4),
+            "raw_score_for_ai": round(ai_score, 4)
+        }
+    }
+
 def test_ai_detection(image_path: str):
     """Test AI generation detection on a sample image."""
     try:
         logger.info(f"Testing AI detection on: {image_path}")
         
-        # Initialize pipeline
-        device = 0 if torch.cuda.is_available() else -1
-        pipe = pipeline("image-classification", model="Organika/sdxl-detector", device=device)
+        # Get (or initialize) pipeline
+        pipe = _get_pipe()
         
         # Run inference
         results = pipe(image_path)
         
         # Process results
-        ai_score = 0.0
-        for result in results:
-            if result['label'] == 'artificial':
-                ai_score = result['score']
-                break
-        
-        is_ai_generated = ai_score > 0.5
-        confidence = ai_score if is_ai_generated else 1 - ai_score
+        summary = _summarize_results(results)
+        detection = summary["ai_detection"]
         
         # Print results
         print("AI Analysis Results:")
         print("=" * 50)
-        print(f"AI Generated: {is_ai_generated}")
-        print(f"Confidence: {confidence:.4f}")
-        print(f"Raw AI Score: {ai_score:.4f}")
+        print(f"AI Generated: {detection['is_ai_generated']}")
+        print(f"Confidence: {detection['confidence_score']:.4f}")
+        print(f"Raw AI Score: {detection['raw_score_for_ai']:.4f}")
         print(f"All Results: {results}")
         
-        return {
-            "ai_detection": {
-                "is_ai_generated": is_ai_generated,
-                "confidence_score": round(confidence, 4),
-                "raw_score_for_ai": round(ai_score, 4)
-            }
-        }
+        return summary
         
     except Exception as e:
         logger.error(f"AI detection failed: {e}")
         return {"error": str(e)}
 
+def test_ai_detection_batch(image_paths: list, batch_size: int = 16):
+    """Test AI generation detection on several images in batched forward passes.
+    Returns one result dict per image, in order (an error dict for each if inference fails)."""
+    try:
+        logger.info(f"Testing batched AI detection on {len(image_paths)} images")
+        
+        pipe = _get_pipe()
+        batch_results = pipe(image_paths, batch_size=batch_size)
+        
+        outputs = []
+        for image_path, results in zip(image_paths, batch_results):
+            summary = _summarize_results(results)
+            detection = summary["ai_detection"]
+            print(f"{image_path}: AI Generated: {detection['is_ai_generated']}, "
+                  f"Confidence: {detection['confidence_score']:.4f}")
+            outputs.append(summary)
+        return outputs
+        
+    except Exception as e:
+        logger.error(f"Batched AI detection failed: {e}")
+        return [{"error": str(e)} for _ in image_paths]
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python test_ai_detection.py <image_path>")
+    if len(sys.argv) < 2:
+        print("Usage: python test_ai_detection.py <image_path> [<image_path> ...]")
         sys.exit(1)
     
-    image_path = sys.argv[1]
-    if not os.path.exists(image_path):
-        print(f"Error: Image file not found: {image_path}")
-        sys.exit(1)
+    image_paths = sys.argv[1:]
+    for image_path in image_paths:
+        if not os.path.exists(image_path):
+            print(f"Error: Image file not found: {image_path}")
+            sys.exit(1)
     
-    results = test_ai_detection(image_path)
+    if len(image_paths) == 1:
+        results = test_ai_detection(image_paths[0])
+    else:
+        results = test_ai_detection_batch(image_paths)
     print(f"\nTest completed.") 
\ No newline at end of file
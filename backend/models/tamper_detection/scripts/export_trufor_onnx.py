@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+TruFor ONNX Export Script
+Exports the pretrained TruFor model to ONNX for serving through ONNX Runtime.
+"""
+
+import sys
+import os
+from pathlib import Path
+
+TRUFOR_LIB = Path(__file__).resolve().parent.parent / "models" / "TruFor" / "TruFor_train_test"
+sys.path.insert(0, str(TRUFOR_LIB))
+
+import torch
+from addict import Dict as AttrDict
+import logging
+
+from lib.config import config, update_config
+from lib.utils import get_model
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class TruForExportWrapper(torch.nn.Module):
+    """Expose TruFor's (pred, conf, det) outputs without the optional noiseprint map."""
+    
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+    
+    def forward(self, rgb):
+        pred, conf, det, _ = self.model(rgb, save_np=False)
+        return pred, conf, det
+
+def export_trufor_onnx(output_path: str, opset_version: int = 17):
+    """Load the TruFor checkpoint and export it with dynamic batch and spatial axes."""
+    args = AttrDict()
+    args.gpu = -1
+    args.experiment = 'trufor_ph3'
+    model_path = TRUFOR_LIB / 'pretrained_models' / 'trufor.pth.tar'
+    args.opts = ['TEST.MODEL_FILE', str(model_path)]
+    
+    # TruFor resolves its experiment config relative to its own directory
+    os.chdir(TRUFOR_LIB)
+    update_config(config, args)
+    
+    logger.info(f"Loading TruFor checkpoint: {model_path}")
+    model = get_model(config)
+    checkpoint = torch.load(str(model_path), map_location='cpu', weights_only=False)
+    model.load_state_dict(checkpoint['state_dict'])
+    model.eval()
+    
+    dummy_rgb = torch.rand(1, 3, 512, 512)
+    spatial = {0: 'B', 2: 'H', 3: 'W'}
+    logger.info(f"Exporting TruFor to: {output_path}")
+    torch.onnx.export(
+        TruForExportWrapper(model),
+        dummy_rgb,
+        output_path,
+        opset_version=opset_version,
+        input_names=['rgb'],
+        output_names=['pred', 'conf', 'det'],
+        dynamic_axes={'rgb': spatial, 'pred': spatial, 'conf': spatial, 'det': {0: 'B'}}
+    )
+    logger.info("Export completed.")
+
+if __name__ == "__main__":
+    default_output = TRUFOR_LIB / 'pretrained_models' / 'trufor.onnx'
+    output_path = Path(sys.argv[1]).resolve() if len(sys.argv) > 1 else default_output
+    export_trufor_onnx(str(output_path))
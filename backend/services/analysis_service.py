@@ -1,17 +1,33 @@
+import io
 import json
+import asyncio
+import contextlib
+import os
+import threading
 import exifread
 from PIL import Image
 import numpy as np
 import cv2
+from config.settings import CPU_THREADS, CUDA_MEMORY_HISTORY, TRUFOR_WARMUP_SIZES
+# OpenMP reads these once when torch loads, so they must be set before the import
+os.environ.setdefault('OMP_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('MKL_NUM_THREADS', str(CPU_THREADS))
+os.environ.setdefault('KMP_AFFINITY', 'granularity=fine,compact,1,0')
+# Read when CUDA initializes: limit block splitting and reclaim cached blocks before the pool fills
+os.environ.setdefault('PYTORCH_CUDA_ALLOC_CONF', 'max_split_size_mb:128,garbage_collection_threshold:0.8')
 import torch
 import sys
-import os
 import insightface
 from insightface.app import FaceAnalysis
-from transformers import pipeline
+from insightface.app.common import Face
+from transformers import AutoImageProcessor, AutoModelForImageClassification
+import onnxruntime as ort
 import logging
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
 
 # Add TruFor model lib to sys.path for import
 TRUFOR_LIB = Path(__file__).parent.parent / "models" / "tamper_detection" / "models" / "TruFor" / "TruFor_train_test"
@@ -19,94 +35,133 @@ sys.path.insert(0, str(TRUFOR_LIB))
 
 # Import TruFor dependencies with error handling
 try:
-    from lib.config import config, update_config
+    from lib.config import config
     from lib.utils import get_model
-    from dataset.dataset_test import TestDataset
     TRUFOR_AVAILABLE = True
 except ImportError as e:
-    print(f"[WARNING] TruFor library not available: {e}")
-    print("[WARNING] Tamper detection will be disabled")
+    logger.warning("TruFor library not available: %s", e)
+    logger.warning("Tamper detection will be disabled")
     TRUFOR_AVAILABLE = False
     config = None
-    update_config = None
     get_model = None
-    TestDataset = None
 
-from torch.nn import functional as F
+# Intel Extension for PyTorch: fused oneDNN kernels for TruFor on Intel CPUs
+try:
+    import intel_extension_for_pytorch as ipex
+except ImportError:
+    ipex = None
+
 from addict import Dict as AttrDict
 
-logger = logging.getLogger(__name__)
+from config.settings import (
+    AI_BATCH_SIZE, AI_BATCH_WINDOW, TRUFOR_BATCH_SIZE, TRUFOR_BATCH_WINDOW, ANALYSIS_WORKERS
+)
+from services.batching import MicroBatcher
+
+# RetinaFace input sizes chosen by the long side of the image: (max long side, det size)
+_FACE_DET_SIZES = ((480, (320, 320)), (1280, (640, 640)))
+_FACE_DET_SIZE_LARGE = (1024, 1024)
+# Large JPEGs are decoded for face detection at 1/8, 1/4 or 1/2 scale by libjpeg's DCT-domain
+# downscaler, picking the largest reduction that keeps the long side in the largest det size bucket
+_REDUCED_DECODES = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+_FACE_DECODE_MIN_LONG_SIDE = _FACE_DET_SIZES[-1][0]
+
+# Index pairs (i < j) over the 5 facial keypoints used for expression measurements
+_KP_PAIRS = np.triu_indices(5, k=1)
+# Response keys for InsightFace's 5-point landmarks
+_KP_NAMES = tuple(f"point_{i}" for i in range(5))
 
 class AnalysisService:
     """Service class for performing forensic analysis on images."""
     
     def __init__(self):
         self.face_app = None
-        self.ai_pipeline = None
+        self.ai_processor = None
+        self.ai_model = None
+        self.ai_device = None
+        self.ai_dtype = None
+        self.ai_batcher = None
         self.emotion_pipeline = None
         self.trufor_model = None
+        self.trufor_session = None
         self.trufor_device = None
         self.trufor_config = None
+        self.trufor_batcher = None
+        # Analysis stages are independent and spend their time in native code
+        # (ONNX Runtime, PyTorch, PIL) with the GIL released, so they run concurrently
+        self._tp = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+        self._cuda_streams = threading.local()
         
-        print("[DEBUG] AnalysisService __init__ called. Initializing models...")
-        logger.info("[DEBUG] AnalysisService __init__ called. Initializing models...")
+        logger.debug("AnalysisService __init__ called. Initializing models...")
         self._initialize_models()
-        print("[DEBUG] All models initialized successfully.")
-        logger.info("[DEBUG] All models initialized successfully.")
+        logger.debug("All models initialized successfully.")
     
     def _initialize_models(self):
         """Initialize all models once during startup."""
         try:
-            print("[DEBUG] Initializing AI detection model...")
-            logger.info("[DEBUG] Initializing AI detection model...")
-            device = 0 if torch.cuda.is_available() else -1
+            logger.debug("Initializing AI detection model...")
             from config.settings import AI_ANALYSIS_PATH
             if AI_ANALYSIS_PATH.exists():
                 model_path = str(AI_ANALYSIS_PATH)
-                print(f"[DEBUG] Using local AI model: {model_path}")
-                logger.info(f"[DEBUG] Using local AI model: {model_path}")
-                self.ai_pipeline = pipeline("image-classification", model=model_path, device=device)
+                logger.debug("Using local AI model: %s", model_path)
             else:
-                print("[DEBUG] Downloading AI model...")
-                logger.info("[DEBUG] Downloading AI model...")
-                self.ai_pipeline = pipeline("image-classification", model="Organika/sdxl-detector", device=device)
-            print("[DEBUG] AI detection model initialized.")
-            logger.info("[DEBUG] AI detection model initialized.")
+                model_path = "Organika/sdxl-detector"
+                logger.debug("Downloading AI model...")
+            # Load processor and model directly (no pipeline): half precision on GPU
+            self.ai_device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
+            self.ai_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+            self.ai_processor = AutoImageProcessor.from_pretrained(model_path)
+            self.ai_model = AutoModelForImageClassification.from_pretrained(model_path, torch_dtype=self.ai_dtype)
+            self.ai_model = self.ai_model.to(self.ai_device).eval()
+            try:
+                # Fused attention kernels via optimum, where the architecture supports it
+                self.ai_model = self.ai_model.to_bettertransformer()
+            except Exception as e:
+                logger.debug("BetterTransformer not used for AI model: %s", e)
+            # Coalesce concurrent single-image requests into batched forward passes
+            self.ai_batcher = MicroBatcher(
+                self._classify_ai,
+                max_batch_size=AI_BATCH_SIZE,
+                max_wait=AI_BATCH_WINDOW,
+                name="ai-batcher"
+            )
+            logger.debug("AI detection model initialized.")
             
-            print("[DEBUG] Initializing face detection model...")
-            logger.info("[DEBUG] Initializing face detection model...")
-            import onnxruntime as ort
+            logger.debug("Initializing face detection model...")
             available_providers = ort.get_available_providers()
             
             if 'CUDAExecutionProvider' in available_providers:
                 providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']
-                print("[DEBUG] GPU acceleration available for face detection")
-                logger.info("[DEBUG] GPU acceleration available for face detection")
+                # Heuristic conv algo search avoids the multi-second EXHAUSTIVE search on first run
+                provider_options = [
+                    {
+                        'cudnn_conv_algo_search': 'HEURISTIC',
+                        'arena_extend_strategy': 'kSameAsRequested',
+                        'gpu_mem_limit': 2 * 1024 ** 3,
+                        'do_copy_in_default_stream': True,
+                    },
+                    {}
+                ]
+                logger.debug("GPU acceleration available for face detection")
             else:
                 providers = ['CPUExecutionProvider']
-                print("[DEBUG] Running face detection on CPU")
-                logger.info("[DEBUG] Running face detection on CPU")
+                provider_options = [{}]
+                logger.debug("Running face detection on CPU")
                 
-            self.face_app = FaceAnalysis(providers=providers)
-            print("[DEBUG] Preparing InsightFace model...")
-            logger.info("[DEBUG] Preparing InsightFace model...")
+            self.face_app = FaceAnalysis(providers=providers, provider_options=provider_options)
+            logger.debug("Preparing InsightFace model...")
             self.face_app.prepare(ctx_id=0, det_size=(640, 640))
-            print("[DEBUG] Face detection model initialized.")
-            logger.info("[DEBUG] Face detection model initialized.")
+            logger.debug("Face detection model initialized.")
             
-            print("[DEBUG] Initializing emotion detection model...")
-            logger.info("[DEBUG] Initializing emotion detection model...")
+            logger.debug("Initializing emotion detection model...")
             device = 0 if torch.cuda.is_available() else -1
-            print("[DEBUG] Using basic emotion detection based on facial features...")
-            logger.info("[DEBUG] Using basic emotion detection based on facial features...")
+            logger.debug("Using basic emotion detection based on facial features...")
             self.emotion_pipeline = None
             
-            print("[DEBUG] Initializing TruFor model...")
-            logger.info("[DEBUG] Initializing TruFor model...")
+            logger.debug("Initializing TruFor model...")
             
             if not TRUFOR_AVAILABLE:
-                print("[WARNING] TruFor not available, skipping tamper detection initialization")
-                logger.warning("[WARNING] TruFor not available, skipping tamper detection initialization")
+                logger.warning("TruFor not available, skipping tamper detection initialization")
                 self.trufor_model = None
                 self.trufor_device = None
                 self.trufor_config = None
@@ -117,64 +172,180 @@ class AnalysisService:
                 model_path = TRUFOR_LIB / 'pretrained_models' / 'trufor.pth.tar'
                 args.opts = ['TEST.MODEL_FILE', str(model_path)]
 
-                # Temporarily change CWD to TRUFOR_LIB
-                original_cwd = os.getcwd()
-                os.chdir(TRUFOR_LIB)
-                update_config(config, args)
-                os.chdir(original_cwd)
+                # Same as TruFor's update_config, which opens the experiment YAML relative to
+                # the CWD; an absolute path avoids a process-wide chdir while other threads run
+                config.defrost()
+                config.merge_from_file(str(TRUFOR_LIB / 'lib' / 'config' / f'{args.experiment}.yaml'))
+                config.merge_from_list(args.opts)
+                config.freeze()
 
                 self.trufor_device = f'cuda:{args.gpu}' if args.gpu >= 0 else 'cpu'
                 self.trufor_config = config
 
-                # Load TruFor model with optimizations
-                self.trufor_model = get_model(config)
-                checkpoint = torch.load(str(model_path), map_location=torch.device(self.trufor_device), weights_only=False)
-                self.trufor_model.load_state_dict(checkpoint['state_dict'])
-                self.trufor_model = self.trufor_model.to(self.trufor_device)
-                self.trufor_model.eval()
+                onnx_path = TRUFOR_LIB / 'pretrained_models' / 'trufor.onnx'
+                if onnx_path.exists():
+                    # Exported by models/tamper_detection/scripts/export_trufor_onnx.py
+                    logger.debug("Using TruFor ONNX model: %s", onnx_path)
+                    if 'CUDAExecutionProvider' in available_providers:
+                        # No memory cap or exact-size arena growth here: those are tuned for the
+                        # small face detector, while TruFor activations at 2048px exceed 2 GiB
+                        trufor_provider_options = [
+                            {
+                                'cudnn_conv_algo_search': 'HEURISTIC',
+                                'do_copy_in_default_stream': True,
+                            },
+                            {}
+                        ]
+                    else:
+                        trufor_provider_options = [{}]
+                    self.trufor_session = ort.InferenceSession(
+                        str(onnx_path), providers=providers, provider_options=trufor_provider_options
+                    )
+                    # Inputs live where the session runs: a CPU-only onnxruntime build can't be
+                    # bound CUDA tensors, even when torch itself has CUDA
+                    on_gpu = 'CUDAExecutionProvider' in self.trufor_session.get_providers()
+                    self.trufor_device = 'cuda:0' if on_gpu and torch.cuda.is_available() else 'cpu'
+                else:
+                    # Load TruFor model with optimizations
+                    self.trufor_model = get_model(config)
+                    checkpoint = torch.load(str(model_path), map_location=torch.device(self.trufor_device), weights_only=False)
+                    self.trufor_model.load_state_dict(checkpoint['state_dict'])
+                    self.trufor_model = self.trufor_model.to(self.trufor_device)
+                    self.trufor_model.eval()
+                    # NHWC layout lets oneDNN / cuDNN pick their faster convolution kernels
+                    self.trufor_model = self.trufor_model.to(memory_format=torch.channels_last)
+            
+            # GPU optimizations
+            if self.trufor_device is not None and self.trufor_device.startswith('cuda'):
+                # Let cuDNN autotune convolution algorithms (cached per input shape)
+                torch.backends.cudnn.benchmark = True
+                if CUDA_MEMORY_HISTORY:
+                    # Inspect with torch.cuda.memory._snapshot() when profiling fragmentation
+                    torch.cuda.memory._record_memory_history(True)
             
             # CPU optimizations
             if self.trufor_device == 'cpu':
-                # Enable optimizations for CPU inference
-                torch.set_num_threads(4)  # Use 4 CPU threads
-                torch.backends.cudnn.benchmark = False
-                # JIT compilation for faster inference
+                # One intra-op thread per physical core; a few inter-op threads for independent ops
+                torch.set_num_threads(CPU_THREADS)
                 try:
-                    self.trufor_model = torch.jit.optimize_for_inference(torch.jit.script(self.trufor_model))
-                    print("[DEBUG] TruFor model JIT optimized for CPU")
-                except Exception as e:
-                    print(f"[DEBUG] JIT optimization failed, using standard model: {e}")
+                    torch.set_num_interop_threads(max(1, CPU_THREADS // 4))
+                except RuntimeError as e:
+                    # Only allowed before any inter-op parallel work has started
+                    logger.debug("Could not set inter-op threads: %s", e)
+                torch.backends.cudnn.benchmark = False
+                if ipex is not None and self.trufor_model is not None:
+                    self.trufor_model = ipex.optimize(self.trufor_model, inplace=True)
+                    logger.debug("TruFor model optimized with IPEX")
+            
+            if self.trufor_model is not None or self.trufor_session is not None:
+                # Coalesce concurrent tamper detection requests into batched forward passes
+                self.trufor_batcher = MicroBatcher(
+                    self._run_trufor_batch,
+                    max_batch_size=TRUFOR_BATCH_SIZE,
+                    max_wait=TRUFOR_BATCH_WINDOW,
+                    name="trufor-batcher"
+                )
             
-            print("[DEBUG] TruFor model initialized.")
-            logger.info("[DEBUG] TruFor model initialized.")
+            logger.debug("TruFor model initialized.")
             
         except Exception as e:
-            logger.error(f"Error initializing models: {str(e)}")
+            logger.error("Error initializing models: %s", e)
             import traceback
             logger.error(traceback.format_exc())
 
-    def extract_exif(self, image_path: str) -> Dict[str, Any]:
-        """Extracts EXIF metadata from an image file."""
+    def _cuda_stream(self):
+        """Per-thread CUDA stream context so concurrent stages don't serialize on the default stream."""
+        if not torch.cuda.is_available():
+            return contextlib.nullcontext()
+        stream = getattr(self._cuda_streams, "stream", None)
+        if stream is None:
+            stream = self._cuda_streams.stream = torch.cuda.Stream()
+        return torch.cuda.stream(stream)
+
+    def shutdown(self) -> None:
+        """Release the stage thread pool."""
+        self._tp.shutdown(wait=False, cancel_futures=True)
+
+    def warmup(self) -> None:
+        """Run one dummy inference through each loaded model so the first request
+        doesn't pay for lazy initialization (CUDA context, kernel selection, allocator)."""
+        logger.info("Warming up models...")
+        # The AI and TruFor warmups go through the batchers so they run on the dispatcher
+        # threads' CUDA streams; the caching allocator only reuses blocks per stream
+        if self.ai_batcher is not None:
+            try:
+                self.ai_batcher.submit(Image.new("RGB", (224, 224)))
+            except Exception as e:
+                logger.warning("AI detection warmup failed: %s", e)
+        
+        if self.face_app is not None:
+            try:
+                # Twice: the first run pays CUDA/cuDNN initialization, the second settles the arena
+                # Warm up every detector input size used by _detect_face_objects
+                for _, det_size in _FACE_DET_SIZES + ((None, _FACE_DET_SIZE_LARGE),):
+                    dummy = np.zeros((det_size[1], det_size[0], 3), dtype=np.uint8)
+                    for _ in range(2):
+                        self._detect_face_objects(dummy, det_size=det_size)
+            except Exception as e:
+                logger.warning("Face detection warmup failed: %s", e)
+        
+        if self.trufor_batcher is not None:
+            try:
+                # On GPU, run the typical input sizes so their activations are already in the allocator cache
+                on_gpu = self.trufor_device is not None and self.trufor_device.startswith('cuda')
+                for size in TRUFOR_WARMUP_SIZES if on_gpu else (256,):
+                    self.trufor_batcher.submit(torch.zeros((3, size, size)))
+            except Exception as e:
+                logger.warning("TruFor warmup failed: %s", e)
+        logger.info("Model warmup completed.")
+
+    def _load_image(self, image_path: str) -> Tuple[Optional[np.ndarray], int, Optional[Image.Image], bytes]:
+        """Read an image once and decode it for every stage: (BGR array for face detection,
+        its downscale factor, full-resolution PIL image, raw bytes).
+        A decoder that can't handle the file yields None so the stage using it reports the error."""
+        with open(image_path, 'rb') as f:
+            raw = f.read()
+        
+        try:
+            pil_img = Image.open(io.BytesIO(raw))
+            # Decode now: the stages read this image concurrently from different threads
+            pil_img.load()
+        except Exception as e:
+            logger.warning("PIL could not decode %s: %s", image_path, e)
+            pil_img = None
+        
+        # Face detection runs at 1024px at most, so skip decoding pixels it would throw away
+        bgr_scale, flags = 1, cv2.IMREAD_COLOR
+        if pil_img is not None and pil_img.format == 'JPEG':
+            long_side = max(pil_img.size)
+            for factor, reduced_flag in _REDUCED_DECODES:
+                if long_side // factor >= _FACE_DECODE_MIN_LONG_SIDE:
+                    bgr_scale, flags = factor, reduced_flag
+                    break
+        img_bgr = cv2.imdecode(np.frombuffer(raw, np.uint8), flags)
+        
+        return img_bgr, bgr_scale, pil_img, raw
+
+    def extract_exif(self, raw: bytes) -> Dict[str, Any]:
+        """Extracts EXIF metadata from the raw bytes of an image file."""
         logger.info("Extracting EXIF data...")
         try:
-            with open(image_path, 'rb') as f:
-                tags = exifread.process_file(f)
+            # details=False skips MakerNote parsing and thumbnail extraction, the slowest parts
+            tags = exifread.process_file(io.BytesIO(raw), details=False, truncate_tags=True)
             
             metadata = {}
             for tag, value in tags.items():
                 if tag not in ('JPEGThumbnail', 'TIFFThumbnail'):
                     metadata[tag] = str(value)
             
-            print(f"[DEBUG] EXIF extraction completed. Found {len(metadata)} tags")
-            logger.info(f"[DEBUG] EXIF extraction completed. Found {len(metadata)} tags")
+            logger.debug("EXIF extraction completed. Found %s tags", len(metadata))
             
             if metadata:
-                print(f"[DEBUG] EXIF tags: {list(metadata.keys())}")
-                logger.info(f"[DEBUG] EXIF tags: {list(metadata.keys())}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("EXIF tags: %s", list(metadata.keys()))
                 return {"exif_data": metadata}
             else:
-                print("[DEBUG] No EXIF data found in image")
-                logger.info("[DEBUG] No EXIF data found in image")
+                logger.debug("No EXIF data found in image")
                 # Return helpful message when no EXIF data is found
                 return {
                     "exif_data": {},
@@ -183,16 +354,15 @@ class AnalysisService:
                 }
                     
         except Exception as e:
-            logger.error(f"Error extracting EXIF data: {str(e)}")
+            logger.error("Error extracting EXIF data: %s", e)
             return {"exif_data": {"error": str(e)}}
 
-    def detect_tampering(self, image_path: str) -> Dict[str, Any]:
+    def detect_tampering(self, pil_img: Optional[Image.Image]) -> Dict[str, Any]:
         """Detects image tampering using the TruFor model."""
         try:
-            print("[DEBUG] detect_tampering called for image: " + image_path)
-            logger.info(f"[DEBUG] detect_tampering called for image: {image_path}")
+            logger.debug("detect_tampering called")
             
-            if not TRUFOR_AVAILABLE or self.trufor_model is None:
+            if not TRUFOR_AVAILABLE or self.trufor_batcher is None:
                 return {
                     "tamper_detection": {
                         "error": "TruFor model not available.",
@@ -200,46 +370,24 @@ class AnalysisService:
                     }
                 }
 
-            # Prepare Dataset with optimizations
-            test_dataset = TestDataset(list_img=[image_path])
-            test_loader = torch.utils.data.DataLoader(
-                test_dataset, 
-                batch_size=1, 
-                num_workers=0,  # Single worker for CPU
-                pin_memory=False  # Disable pin_memory for CPU
-            )
+            if pil_img is None:
+                return {"tamper_detection": {"error": "Could not read image file."}}
 
-            # Run Inference using pre-loaded model with optimizations
-            print("[DEBUG] TruFor inference running...")
-            logger.info("[DEBUG] TruFor inference running...")
-            
-            # Set inference mode and disable gradients
-            self.trufor_model.eval()
-            with torch.no_grad():
-                for rgb, _ in test_loader:
-                    rgb = rgb.to(self.trufor_device)
-                    
-                    # Optimize input tensor
-                    if self.trufor_device == 'cpu':
-                        rgb = rgb.contiguous()  # Ensure contiguous memory layout
-                    
-                    pred, conf, det, _ = self.trufor_model(rgb, save_np=False)
+            # Same preprocessing as TruFor's TestDataset: RGB, CHW, float scaled by 1/256
+            img_RGB = np.asarray(pil_img.convert("RGB"))
+            rgb = torch.from_numpy(img_RGB.transpose(2, 0, 1)).float() / 256.0
 
-                    if det is not None:
-                        score = torch.sigmoid(det).item()
-                    else:
-                        score = -1
+            # Run Inference using pre-loaded model, batched with concurrent requests
+            logger.debug("TruFor inference running...")
+            score, map_shape = self.trufor_batcher.submit(rgb)
 
-                    pred_map = torch.squeeze(pred, 0)
-                    pred_map = F.softmax(pred_map, dim=0)[1].cpu().numpy()
-
-                    return {
-                        "integrity_score": score,
-                        "localization_map_shape": pred_map.shape
-                    }
+            return {
+                "integrity_score": score,
+                "localization_map_shape": map_shape
+            }
         except Exception as e:
             import traceback
-            logger.error(f"TruFor analysis failed: {str(e)}")
+            logger.error("TruFor analysis failed: %s", e)
             return {
                 "tamper_detection": {
                     "error": "Failed to run TruFor tamper detection.",
@@ -248,12 +396,66 @@ class AnalysisService:
                 }
             }
 
-    def detect_ai_generation(self, image_path: str) -> Dict[str, Any]:
+    def _run_trufor_batch(self, images: List[torch.Tensor]) -> List[Tuple[float, Tuple[int, int]]]:
+        """Run TruFor on a batch of preprocessed [3, H, W] tensors, returning (integrity score,
+        localization map shape) per image. Only images with the same resolution can be stacked, so
+        each shape gets its own forward pass."""
+        by_shape: Dict[Tuple[int, ...], List[int]] = {}
+        for i, image in enumerate(images):
+            by_shape.setdefault(tuple(image.shape), []).append(i)
+        
+        outputs: List[Any] = [None] * len(images)
+        with torch.inference_mode(), self._cuda_stream():
+            for indices in by_shape.values():
+                rgb = torch.stack([images[i] for i in indices]).to(self.trufor_device)
+                if self.trufor_session is not None:
+                    map_shape, det = self._run_trufor_onnx(rgb)
+                else:
+                    rgb = rgb.contiguous(memory_format=torch.channels_last)
+                    pred, conf, det, _ = self.trufor_model(rgb, save_np=False)
+                    # Only the map's shape is reported: skip the softmax and device-to-host copy
+                    map_shape = tuple(pred.shape[-2:])
+                for j, i in enumerate(indices):
+                    if det is not None:
+                        score = torch.sigmoid(det[j]).item()
+                    else:
+                        score = -1
+                    outputs[i] = (score, map_shape)
+        return outputs
+
+    def _run_trufor_onnx(self, rgb: torch.Tensor) -> Tuple[Tuple[int, int], Optional[torch.Tensor]]:
+        """Run the exported TruFor graph, binding the input tensor's memory in place (no host copy).
+        Returns the localization map's (H, W) and the detection logits; the map itself stays
+        wherever ORT computed it and the unused confidence map isn't fetched."""
+        rgb = rgb.contiguous()
+        device_type = 'cuda' if rgb.is_cuda else 'cpu'
+        if rgb.is_cuda:
+            # ORT reads the buffer on its own stream; make sure the upload has landed
+            torch.cuda.current_stream().synchronize()
+        
+        binding = self.trufor_session.io_binding()
+        binding.bind_input(
+            'rgb', device_type, rgb.device.index or 0, np.float32, tuple(rgb.shape), rgb.data_ptr()
+        )
+        output_names = [output.name for output in self.trufor_session.get_outputs()]
+        binding.bind_output('pred', device_type)
+        has_det = 'det' in output_names
+        if has_det:
+            # A few bytes per image; copied to host by ORT since the score is read on CPU
+            binding.bind_output('det', 'cpu')
+        self.trufor_session.run_with_iobinding(binding)
+        
+        outputs = binding.get_outputs()
+        map_shape = tuple(outputs[0].shape()[-2:])
+        det = torch.from_numpy(outputs[1].numpy()) if has_det else None
+        return map_shape, det
+
+    def detect_ai_generation(self, pil_img: Optional[Image.Image]) -> Dict[str, Any]:
         """Detects if an image is AI-generated using Hugging Face model."""
         try:
-            logger.info(f"Analyzing {image_path} for AI generation...")
+            logger.info("Analyzing image for AI generation...")
             
-            if self.ai_pipeline is None:
+            if self.ai_batcher is None:
                 return {
                     "ai_detection": {
                         "error": "AI detection model not initialized.",
@@ -261,41 +463,82 @@ class AnalysisService:
                     }
                 }
 
-            # Run inference using pre-loaded pipeline
-            logger.info("Running AI detection inference...")
-            results = self.ai_pipeline(image_path)
+            if pil_img is None:
+                return {"ai_detection": {"error": "Could not read image file."}}
 
-            # Process results
-            ai_score = 0.0
-            for result in results:
-                if result['label'] == 'artificial':
-                    ai_score = result['score']
-                    break
-            
-            is_ai_generated = ai_score > 0.5
-            confidence = ai_score if is_ai_generated else 1 - ai_score
+            # Run inference using pre-loaded model
+            logger.info("Running AI detection inference...")
+            scores = self.ai_batcher.submit(pil_img)
+            return self._summarize_ai_scores(scores)
 
+        except Exception as e:
+            import traceback
+            logger.error("AI detection failed: %s", e)
             return {
                 "ai_detection": {
-                    "is_ai_generated": is_ai_generated,
-                    "confidence_score": round(confidence, 4),
-                    "raw_score_for_ai": round(ai_score, 4)
+                    "error": "Failed to run Hugging Face AI detection.",
+                    "details": str(e),
+                    "trace": traceback.format_exc()
                 }
             }
 
+    def detect_ai_generation_batch(self, pil_images: List[Optional[Image.Image]]) -> List[Dict[str, Any]]:
+        """Detects AI generation for several images in batched forward passes."""
+        try:
+            decoded = [img for img in pil_images if img is not None]
+            if self.ai_model is None or not decoded:
+                return [self.detect_ai_generation(img) for img in pil_images]
+
+            logger.info("Running batched AI detection inference on %s images...", len(decoded))
+            batch_scores = []
+            for start in range(0, len(decoded), AI_BATCH_SIZE):
+                batch_scores.extend(self._classify_ai(decoded[start:start + AI_BATCH_SIZE]))
+            batch_scores = iter(batch_scores)
+            return [
+                self._summarize_ai_scores(next(batch_scores)) if img is not None
+                else self.detect_ai_generation(img)
+                for img in pil_images
+            ]
+
         except Exception as e:
             import traceback
-            logger.error(f"AI detection failed: {str(e)}")
-            return {
+            logger.error("Batched AI detection failed: %s", e)
+            error = {
                 "ai_detection": {
                     "error": "Failed to run Hugging Face AI detection.",
                     "details": str(e),
                     "trace": traceback.format_exc()
                 }
             }
+            return [error for _ in pil_images]
+
+    def _classify_ai(self, pil_images: List[Image.Image]) -> List[Dict[str, float]]:
+        """Run the AI detector on a batch of images, returning label -> probability per image."""
+        inputs = self.ai_processor(images=[img.convert("RGB") for img in pil_images], return_tensors="pt")
+        pixel_values = inputs["pixel_values"].to(self.ai_device, dtype=self.ai_dtype)
+        with torch.inference_mode(), self._cuda_stream():
+            probs = self.ai_model(pixel_values=pixel_values).logits.float().softmax(-1).cpu()
+        id2label = self.ai_model.config.id2label
+        return [{id2label[i]: p for i, p in enumerate(row)} for row in probs.tolist()]
+
+    def _summarize_ai_scores(self, scores: Dict[str, float]) -> Dict[str, Any]:
+        """Convert per-label probabilities into the AI detection result."""
+        ai_score = scores.get('artificial', 0.0)
+        
+        is_ai_generated = ai_score > 0.5
+        confidence = ai_score if is_ai_generated else 1 - ai_score
+
+        return {
+            "ai_detection": {
+                "is_ai_generated": is_ai_generated,
+                "confidence_score": confidence,
+                "raw_score_for_ai": ai_score
+            }
+        }
 
-    def detect_faces(self, image_path: str) -> Dict[str, Any]:
-        """Detects faces, age, gender, emotion, and keypoints using InsightFace and emotion classification."""
+    def detect_faces(self, img: Optional[np.ndarray], scale: int = 1) -> Dict[str, Any]:
+        """Detects faces, age, gender, emotion, and keypoints using InsightFace and emotion classification.
+        `scale` is how much `img` was downscaled on decode; coordinates are reported at full resolution."""
         try:
             if self.face_app is None:
                 return {
@@ -305,24 +548,21 @@ class AnalysisService:
                     }
                 }
 
-            # Read the image
-            img = cv2.imread(image_path)
             if img is None:
                 return {"face_detection": {"error": "Could not read image file."}}
 
             # Detect faces using pre-loaded model
             logger.info("Running face detection...")
-            faces = self.face_app.get(img)
+            faces = self._detect_face_objects(img)
 
             # Process the results
             face_results = []
+            h, w = img.shape[:2]
             for i, face in enumerate(faces):
-                # Extract face region for emotion analysis
-                bbox = face.bbox.astype(int)
-                x1, y1, x2, y2 = bbox
+                # Extract face region for emotion analysis, in decoded image coordinates
+                x1, y1, x2, y2 = face.bbox.astype(np.int32).tolist()
                 
                 # Ensure coordinates are within image bounds
-                h, w = img.shape[:2]
                 x1 = max(0, x1)
                 y1 = max(0, y1)
                 x2 = min(w, x2)
@@ -331,8 +571,17 @@ class AnalysisService:
                 # Extract face crop for emotion analysis
                 face_crop = img[y1:y2, x1:x2]
                 
+                if scale != 1:
+                    # Map back to the original resolution before measuring and reporting
+                    face.bbox = face.bbox * scale
+                    face.kps = face.kps * scale
+                # Integer coordinates for the response, cast once in C and kept as arrays:
+                # the routes serialize them with orjson's native numpy support
+                bbox_int = face.bbox.astype(np.int32)
+                kps_int = face.kps.astype(np.int32)
+                
                 # Basic facial expression analysis based on keypoints
-                emotion_result = self._analyze_facial_expression(face, face_crop, image_path, i)
+                emotion_result = self._analyze_facial_expression(face, face_crop, i)
                 
                 # Get gender with better error handling
                 gender = "Unknown"
@@ -344,28 +593,22 @@ class AnalysisService:
                     else:
                         gender = "Unknown"
                 except Exception as e:
-                    logger.warning(f"Gender detection failed for face {i}: {str(e)}")
+                    logger.warning("Gender detection failed for face %s: %s", i, e)
                     gender = "Unknown"
                 
-                # Get age with better error handling
-                age = "Unknown"
-                try:
-                    if hasattr(face, 'age') and face.age is not None:
-                        age = face.age
-                    else:
-                        age = "Unknown"
-                except Exception as e:
-                    logger.warning(f"Age detection failed for face {i}: {str(e)}")
+                # Get age, if the attribute model provided one
+                age = getattr(face, 'age', None)
+                if age is None:
                     age = "Unknown"
                 
                 face_data = {
                     "face_id": i + 1,
-                    "bounding_box": [int(x) for x in face.bbox.tolist()],
+                    "bounding_box": bbox_int,
                     "confidence": float(face.det_score),
                     "age": age,
                     "gender": gender,
                     "emotion": emotion_result,
-                    "keypoints": {f"point_{j}": [int(pt[0]), int(pt[1])] for j, pt in enumerate(face.kps.tolist())}
+                    "keypoints": dict(zip(_KP_NAMES, kps_int))
                 }
                 face_results.append(face_data)
 
@@ -377,7 +620,7 @@ class AnalysisService:
             }
         except Exception as e:
             import traceback
-            logger.error(f"Face detection failed: {str(e)}")
+            logger.error("Face detection failed: %s", e)
             return {
                 "face_detection": {
                     "error": "An error occurred during face analysis.",
@@ -386,17 +629,41 @@ class AnalysisService:
                 }
             }
 
-    def _analyze_facial_expression(self, face, face_crop, image_path, face_index) -> Dict[str, Any]:
+    def _detect_face_objects(self, img: np.ndarray,
+                             det_size: Optional[Tuple[int, int]] = None) -> List[Face]:
+        """Same as FaceAnalysis.get, but with the detector input size picked per image:
+        small images skip upscaling to 640, large ones keep enough resolution for small faces.
+        The size is passed per call rather than set on the shared detector, which is thread-safe.
+        `det_size` overrides the choice (used by warmup)."""
+        if det_size is None:
+            long_side = max(img.shape[:2])
+            det_size = _FACE_DET_SIZE_LARGE
+            for max_long_side, size in _FACE_DET_SIZES:
+                if long_side < max_long_side:
+                    det_size = size
+                    break
+        
+        bboxes, kpss = self.face_app.det_model.detect(img, input_size=det_size, max_num=0, metric='default')
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(
+                bbox=bboxes[i, 0:4],
+                kps=kpss[i] if kpss is not None else None,
+                det_score=bboxes[i, 4]
+            )
+            for taskname, model in self.face_app.models.items():
+                if taskname == 'detection':
+                    continue
+                model.get(img, face)
+            faces.append(face)
+        return faces
+
+    def _analyze_facial_expression(self, face, face_crop, face_index) -> Dict[str, Any]:
         """Analyze facial expression based on facial keypoints and features."""
         try:
             kps = face.kps
-            print(f"[DEBUG] Face {face_index} - Keypoints shape: {kps.shape if kps is not None else 'None'}")
-            logger.info(f"[DEBUG] Face {face_index} - Keypoints shape: {kps.shape if kps is not None else 'None'}")
             
             if kps is not None and len(kps) >= 5:
-                print(f"[DEBUG] Face {face_index} - Processing {len(kps)} keypoints")
-                logger.info(f"[DEBUG] Face {face_index} - Processing {len(kps)} keypoints")
-                
                 # InsightFace uses 5-point landmarks: left_eye, right_eye, nose, left_mouth, right_mouth
                 # But let's be more flexible and use the first 5 keypoints
                 if len(kps) >= 5:
@@ -406,17 +673,14 @@ class AnalysisService:
                     # Calculate distances between keypoints for emotion analysis
                     # Use a more robust approach
                     try:
-                        # Calculate various facial measurements
-                        measurements = []
-                        for i in range(len(keypoints)):
-                            for j in range(i+1, len(keypoints)):
-                                dist = np.linalg.norm(keypoints[i] - keypoints[j])
-                                measurements.append(dist)
+                        # Calculate all pairwise keypoint distances (upper triangle) in one pass
+                        diffs = keypoints[:, None, :] - keypoints[None, :, :]
+                        measurements = np.sqrt((diffs * diffs).sum(-1))[_KP_PAIRS]
                         
-                        if measurements:
-                            avg_distance = np.mean(measurements)
-                            max_distance = np.max(measurements)
-                            min_distance = np.min(measurements)
+                        if measurements.size:
+                            avg_distance = measurements.mean()
+                            max_distance = measurements.max()
+                            min_distance = measurements.min()
                             
                             # Simple emotion classification based on facial proportions
                             if max_distance > avg_distance * 1.5:
@@ -429,9 +693,6 @@ class AnalysisService:
                                 emotion = "neutral"
                                 confidence = 0.8
                             
-                            print(f"[DEBUG] Face {face_index} - Emotion: {emotion}, Confidence: {confidence}")
-                            logger.info(f"[DEBUG] Face {face_index} - Emotion: {emotion}, Confidence: {confidence}")
-                            
                             return {
                                 "emotion": emotion,
                                 "confidence": confidence,
@@ -446,45 +707,91 @@ class AnalysisService:
                         else:
                             return {"emotion": "neutral", "confidence": 0.5, "method": "no_measurements"}
                     except Exception as e:
-                        print(f"[DEBUG] Face {face_index} - Measurement calculation failed: {e}")
-                        logger.warning(f"Face {face_index} - Measurement calculation failed: {e}")
+                        logger.warning("Face %s - Measurement calculation failed: %s", face_index, e)
                         return {"emotion": "neutral", "confidence": 0.5, "method": "measurement_failed"}
                 else:
-                    print(f"[DEBUG] Face {face_index} - Insufficient keypoints: {len(kps)}")
-                    logger.warning(f"Face {face_index} - Insufficient keypoints: {len(kps)}")
+                    logger.warning("Face %s - Insufficient keypoints: %s", face_index, len(kps))
                     return {"emotion": "neutral", "confidence": 0.5, "method": "insufficient_keypoints"}
             else:
-                print(f"[DEBUG] Face {face_index} - No keypoints available")
-                logger.warning(f"Face {face_index} - No keypoints available")
+                logger.warning("Face %s - No keypoints available", face_index)
                 return {"emotion": "neutral", "confidence": 0.5, "method": "no_keypoints"}
             
         except Exception as e:
-            print(f"[DEBUG] Face {face_index} - Facial expression analysis failed: {str(e)}")
-            logger.warning(f"Facial expression analysis failed: {str(e)}")
+            logger.warning("Facial expression analysis failed: %s", e)
             return {"emotion": "neutral", "confidence": 0.5, "method": "failed"}
 
-    def analyze(self, image_path: str) -> Dict[str, Any]:
-        """Performs a full forensic analysis of an image."""
-        logger.info(f"Starting full forensic analysis for {image_path}...")
-        results = {}
+    async def analyze(self, image_path: str) -> Dict[str, Any]:
+        """Performs a full forensic analysis of an image, running the stages concurrently."""
+        logger.info("Starting full forensic analysis for %s...", image_path)
+        loop = asyncio.get_running_loop()
         
-        # 1. Extract EXIF data
-        results.update(self.extract_exif(image_path))
+        # Read and decode once, then share the decoded image across stages
+        img_bgr, bgr_scale, pil_img, raw = await loop.run_in_executor(self._tp, self._load_image, image_path)
         
-        # 2. Detect tampering
-        tamper_results = self.detect_tampering(image_path)
+        # EXIF extraction, tamper detection, AI detection and face detection are independent
+        exif_results, tamper_results, ai_results, face_results = await asyncio.gather(
+            loop.run_in_executor(self._tp, self.extract_exif, raw),
+            loop.run_in_executor(self._tp, self.detect_tampering, pil_img),
+            loop.run_in_executor(self._tp, self.detect_ai_generation, pil_img),
+            loop.run_in_executor(self._tp, self.detect_faces, img_bgr, bgr_scale),
+        )
+        
+        results = {}
+        results.update(exif_results)
         results['tamper_detection'] = tamper_results
-
-        # 3. Detect AI generation
-        ai_results = self.detect_ai_generation(image_path)
         results['ai_detection'] = ai_results
-
-        # 4. Detect faces
-        face_results = self.detect_faces(image_path)
         results['face_detection'] = face_results
         
         logger.info("Forensic analysis completed")
         return results
 
-# Global instance
-analysis_service = AnalysisService() 
\ No newline at end of file
+    async def analyze_batch(self, image_paths: List[str]) -> List[Dict[str, Any]]:
+        """Performs a full forensic analysis of several images, batching the AI detector."""
+        logger.info("Starting batch forensic analysis for %s images...", len(image_paths))
+        loop = asyncio.get_running_loop()
+        
+        loaded = await asyncio.gather(
+            *(loop.run_in_executor(self._tp, self._load_image, path) for path in image_paths)
+        )
+        images_bgr, bgr_scales, pil_images, raws = zip(*loaded)
+        
+        def run_per_image(fn, inputs):
+            return [loop.run_in_executor(self._tp, fn, item) for item in inputs]
+        
+        n = len(image_paths)
+        gathered = await asyncio.gather(
+            loop.run_in_executor(self._tp, self.detect_ai_generation_batch, list(pil_images)),
+            *run_per_image(self.extract_exif, raws),
+            *run_per_image(self.detect_tampering, pil_images),
+            *(loop.run_in_executor(self._tp, self.detect_faces, img, scale)
+              for img, scale in zip(images_bgr, bgr_scales)),
+        )
+        ai_results = gathered[0]
+        exif_results = gathered[1:1 + n]
+        tamper_results = gathered[1 + n:1 + 2 * n]
+        face_results = gathered[1 + 2 * n:]
+        
+        batch_results = []
+        for i in range(n):
+            results = {}
+            results.update(exif_results[i])
+            results['tamper_detection'] = tamper_results[i]
+            results['ai_detection'] = ai_results[i]
+            results['face_detection'] = face_results[i]
+            batch_results.append(results)
+        
+        logger.info("Batch forensic analysis completed")
+        return batch_results
+
+# Created on first use so importing this module doesn't load the models
+_analysis_service: Optional[AnalysisService] = None
+_analysis_service_lock = threading.Lock()
+
+def get_analysis_service() -> AnalysisService:
+    """Return the process-wide AnalysisService, loading the models on the first call."""
+    global _analysis_service
+    if _analysis_service is None:
+        with _analysis_service_lock:
+            if _analysis_service is None:
+                _analysis_service = AnalysisService()
+    return _analysis_service
@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from typing import Any, Callable, List
+
+logger = logging.getLogger(__name__)
+
+class MicroBatcher:
+    """Coalesces calls arriving from concurrent threads into batched invocations.
+    
+    Callers block in submit() while a dispatcher thread runs process_batch once per
+    batch. A lone item is dispatched right away; when others are already queued, the
+    dispatcher keeps collecting for up to max_wait seconds (or max_batch_size items).
+    """
+    
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int, max_wait: float, name: str = "batcher"):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+    
+    def submit(self, item: Any) -> Any:
+        """Queue an item and block until its result from the batched call is ready."""
+        future: Future = Future()
+        self._queue.put((item, future))
+        return future.result()
+    
+    def _collect(self) -> List[tuple]:
+        batch = [self._queue.get()]
+        # Nothing else waiting: don't make a lone request pay the batching window
+        if self._queue.empty():
+            return batch
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.process_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            if len(results) != len(batch):
+                # zip() would leave the extra callers blocked in submit() forever
+                error = RuntimeError(
+                    f"process_batch returned {len(results)} results for {len(batch)} items"
+                )
+                for _, future in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
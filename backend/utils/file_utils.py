@@ -1,21 +1,44 @@
 import os
 import uuid
-from pathlib import Path
+import shutil
+import hashlib
 from fastapi import UploadFile, HTTPException
-from typing import Optional
+from typing import Optional, Tuple
 import logging
+import aiofiles
 
-from config.settings import UPLOADS_DIR, ALLOWED_EXTENSIONS, MAX_FILE_SIZE
+from config.settings import UPLOADS_DIR, UPLOADS_STR, ALLOWED_EXTENSIONS, MAX_FILE_SIZE, UPLOAD_CHUNK_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Prefer BLAKE3 (SIMD, GIL-releasing) for upload content digests; fall back to hashlib
+try:
+    from blake3 import blake3
+    
+    def _new_content_hasher():
+        return blake3(max_threads=blake3.AUTO)
+except ImportError:
+    def _new_content_hasher():
+        return hashlib.blake2b(digest_size=16)
+
+_ALLOWED_EXTS = frozenset(ext.lower() for ext in ALLOWED_EXTENSIONS)
+_INVALID_TYPE_MSG = f"Invalid file type. Allowed types: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+
+def _file_extension(filename: str) -> str:
+    """Return the filename's extension including the dot, or '' if it has none."""
+    dot = filename.rfind('.')
+    return filename[dot:] if dot != -1 else ''
+
+def _is_allowed_extension(extension: str) -> bool:
+    """Check an extension as returned by _file_extension against the allowed types."""
+    return extension.lower() in _ALLOWED_EXTS
+
 def validate_file_extension(filename: str) -> bool:
     """Validate if the file extension is allowed."""
     if not filename:
         return False
     
-    file_ext = Path(filename).suffix.lower()
-    return file_ext in ALLOWED_EXTENSIONS
+    return _is_allowed_extension(_file_extension(filename))
 
 def validate_file_size(file_size: int) -> bool:
     """Validate if the file size is within limits."""
@@ -25,51 +48,71 @@ def create_session_id() -> str:
     """Generate a unique session ID."""
     return str(uuid.uuid4())
 
-def save_uploaded_file(file: UploadFile, session_id: str) -> str:
-    """Save uploaded file and return the file path."""
+async def save_uploaded_file(file: UploadFile, session_id: str) -> Tuple[str, str]:
+    """Stream uploaded file to disk in chunks and return the file path and content digest."""
     try:
-        # Validate file extension
-        if not validate_file_extension(file.filename):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
-            )
+        # Validate file extension, split off once and reused for the stored filename
+        file_extension = _file_extension(file.filename) if file.filename else ''
+        if not _is_allowed_extension(file_extension):
+            raise HTTPException(status_code=400, detail=_INVALID_TYPE_MSG)
         
         # Create session directory
         session_dir = UPLOADS_DIR / session_id
         session_dir.mkdir(exist_ok=True)
         
         # Generate unique filename
-        file_extension = Path(file.filename).suffix
         unique_filename = f"{uuid.uuid4()}{file_extension}"
         file_path = session_dir / unique_filename
         
-        # Save file
-        with open(file_path, "wb") as buffer:
-            content = file.file.read()
-            buffer.write(content)
+        # Save file chunk by chunk so the whole upload is never held in memory
+        # and hash it in the same pass for the result cache
+        hasher = _new_content_hasher()
+        bytes_written = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            if hasattr(os, "posix_fadvise"):
+                # Hint sequential access so the kernel can write behind aggressively
+                os.posix_fadvise(buffer.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                bytes_written += len(chunk)
+                # Check the size as we go so an oversized upload is never fully stored
+                if not validate_file_size(bytes_written):
+                    break
+                hasher.update(chunk)
+                await buffer.write(chunk)
         
-        logger.info(f"File saved: {file_path}")
-        return str(file_path)
+        if not validate_file_size(bytes_written):
+            file_path.unlink(missing_ok=True)
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large. Maximum size: {MAX_FILE_SIZE // (1024 * 1024)}MB"
+            )
         
+        logger.info("File saved: %s", file_path)
+        return str(file_path), hasher.hexdigest()
+    
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error saving file: {str(e)}")
+        logger.error("Error saving file: %s", e)
         raise HTTPException(status_code=500, detail="Failed to save file")
 
 def cleanup_session(session_id: str) -> None:
     """Clean up session files after analysis."""
     try:
-        session_dir = UPLOADS_DIR / session_id
-        if session_dir.exists():
-            for file_path in session_dir.iterdir():
-                if file_path.is_file():
-                    file_path.unlink()
-            session_dir.rmdir()
-            logger.info(f"Cleaned up session: {session_id}")
+        session_dir = os.path.realpath(os.path.join(UPLOADS_STR, session_id))
+        # Only ever remove a direct child of the uploads dir (rejects "..", "." and the like)
+        if os.path.dirname(session_dir) != UPLOADS_STR:
+            logger.warning("Refusing to clean up invalid session id: %s", session_id)
+            return
+        if os.path.isdir(session_dir):
+            shutil.rmtree(session_dir, ignore_errors=True)
+            logger.info("Cleaned up session: %s", session_id)
     except Exception as e:
-        logger.warning(f"Error cleaning up session {session_id}: {str(e)}")
+        logger.warning("Error cleaning up session %s: %s", session_id, e)
 
-def get_file_path(session_id: str, filename: str) -> Optional[Path]:
-    """Get the full path of a file in a session."""
-    file_path = UPLOADS_DIR / session_id / filename
-    return file_path if file_path.exists() else None 
\ No newline at end of file
+def get_file_path(session_id: str, filename: str) -> Optional[str]:
+    """Get the full path of a file in a session, or None if missing or outside the uploads dir."""
+    file_path = os.path.realpath(os.path.join(UPLOADS_STR, session_id, filename))
+    if os.path.commonpath([UPLOADS_STR, file_path]) != UPLOADS_STR:
+        return None
+    return file_path if os.path.isfile(file_path) else None 
\ No newline at end of file
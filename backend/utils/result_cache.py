@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from config.settings import RESULT_CACHE_SIZE
+
+class ResultCache:
+    """Thread-safe LRU cache of analysis results keyed by image content digest."""
+    
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def lookup(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Return cached results for a digest, or None on a miss."""
+        with self._lock:
+            results = self._entries.get(digest)
+            if results is not None:
+                self._entries.move_to_end(digest)
+            return results
+    
+    def update(self, digest: str, results: Dict[str, Any]) -> None:
+        """Store results for a digest, evicting the least recently used entry if full."""
+        with self._lock:
+            self._entries[digest] = results
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+def has_stage_error(results: Dict[str, Any]) -> bool:
+    """True if any analysis stage reported an error, at the top level of its result or one
+    level down (e.g. {"tamper_detection": {"error": ...}}). Such results may come from a
+    transient failure and shouldn't be cached."""
+    for stage in results.values():
+        if not isinstance(stage, dict):
+            continue
+        if "error" in stage:
+            return True
+        if any(isinstance(inner, dict) and "error" in inner for inner in stage.values()):
+            return True
+    return False
+
+# Global instance
+result_cache = ResultCache()